@@ -1,11 +1,26 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import datetime as dt
 import os
 import json
 import re
+import csv
+import uuid
+import threading
+import openpyxl
 import plotly.graph_objects as go
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 # =========================
 # CONFIG
@@ -13,75 +28,228 @@ from io import BytesIO
 st.set_page_config(page_title="TNG | Control de Materiales", layout="wide")
 
 DB_FILE = "db_proyectos.json"
+# Formato de la BD: "parquet" (binario, comprimido, un archivo por proyecto) o "json"
+DB_FORMAT = os.getenv("DB_FORMAT", "parquet").strip().lower()
+DB_DIR = "db_proyectos"
+DB_INDEX = os.path.join(DB_DIR, "index.json")
+DB_LOCK = "db_proyectos.lock"
 ADMIN_PASS = os.getenv("ADMIN_PASS", "1234")
 PDF_DIR = "pdf_notas"
 
 if not os.path.exists(PDF_DIR):
     os.makedirs(PDF_DIR)
 
-# Detecta: SERVICIO / SERVICIOS / SERVICIO-PRECIO FIJO / etc.
-SERVICIO_RE = re.compile(r"\bSERVICI", re.IGNORECASE)
-
 # =========================
 # PERSISTENCIA
 # =========================
-def cargar_datos():
-    if os.path.exists(DB_FILE):
+@contextmanager
+def _bloqueo_db(exclusivo=True):
+    # Lock entre procesos/sesiones; lectores comparten, escritores excluyen
+    with open(DB_LOCK, "a+") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
         try:
-            with open(DB_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            return []
-    return []
-
-def guardar_datos(lista_proyectos):
-    with open(DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(lista_proyectos, f, ensure_ascii=False, indent=2, default=str)
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _escribir_atomico(path, escribir, modo="w"):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    kwargs = {"encoding": "utf-8"} if "b" not in modo else {}
+    with open(tmp, modo, **kwargs) as f:
+        escribir(f)
+    os.replace(tmp, path)
+
+def _archivo_items(p: dict) -> str:
+    base = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(p.get("id") or p.get("nombre") or "proyecto"))
+    return os.path.join(DB_DIR, f"{base}.parquet")
+
+def _escribir_items_parquet(p: dict):
+    os.makedirs(DB_DIR, exist_ok=True)
+    items = items_a_df(p.get("resumen", {}).get("items"))
+    _escribir_atomico(_archivo_items(p), lambda f: items.to_parquet(f, compression="zstd", index=False), modo="wb")
+
+def _registro(p: dict) -> dict:
+    # Forma en disco: en parquet los items van aparte, en json van embebidos
+    r = {k: v for k, v in p.get("resumen", {}).items() if k != "items"}
+    if DB_FORMAT != "parquet":
+        r["items"] = items_a_registros(p.get("resumen", {}).get("items"))
+    return {**p, "resumen": r}
+
+def _leer_registros() -> list:
+    path = DB_INDEX if DB_FORMAT == "parquet" else DB_FILE
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _escribir_registros(registros: list):
+    if DB_FORMAT == "parquet":
+        os.makedirs(DB_DIR, exist_ok=True)
+        _escribir_atomico(DB_INDEX, lambda f: json.dump(registros, f, ensure_ascii=False, default=str))
+    else:
+        _escribir_atomico(DB_FILE, lambda f: json.dump(registros, f, ensure_ascii=False, indent=2, default=str))
+
+def _cargar_json() -> list:
+    with open(DB_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _cargar_parquet() -> list:
+    with open(DB_INDEX, "r", encoding="utf-8") as f:
+        lista = json.load(f)
+    for p in lista:
+        path = _archivo_items(p)
+        p.setdefault("resumen", {})["items"] = pd.read_parquet(path) if os.path.exists(path) else []
+    return lista
+
+def _sin_items(p: dict) -> dict:
+    return {**p, "resumen": {k: v for k, v in p.get("resumen", {}).items() if k != "items"}}
+
+def _origen_datos():
+    # Si quedaron ambos almacenes (BD de antes del respaldo .bak), manda el más reciente
+    hay_parquet = os.path.exists(DB_INDEX)
+    hay_json = os.path.exists(DB_FILE)
+    if hay_parquet and hay_json:
+        return "parquet" if os.path.getmtime(DB_INDEX) >= os.path.getmtime(DB_FILE) else "json"
+    if hay_parquet:
+        return "parquet"
+    return "json" if hay_json else None
+
+def _convertir_bd():
+    # Todo bajo el lock exclusivo: otra sesión pudo convertir mientras tanto
+    with _bloqueo_db():
+        origen = _origen_datos()
+        if origen is None or (origen == "parquet") == (DB_FORMAT == "parquet"):
+            return
+        lista = _cargar_parquet() if origen == "parquet" else _cargar_json()
+        for p in lista:
+            r = p.setdefault("resumen", {})
+            r["items"] = filtrar_items_servicios(aplicar_reglas(items_a_df(r.get("items", []))))
+            r.pop("criticos", None)  # BD vieja: los críticos se calculan al ver
+            r.update(agregados_desde_items(r["items"]))  # y los agregados quedan sellados
+        _escribir_bd(lista)
+        # El origen queda como respaldo con otro nombre: no se vuelve a leer
+        path = DB_INDEX if origen == "parquet" else DB_FILE
+        os.replace(path, f"{path}.bak")
+        if origen == "parquet":
+            # Los items ya están en el JSON: no quedan archivos huérfanos
+            for f in os.listdir(DB_DIR):
+                if f.endswith(".parquet"):
+                    os.remove(os.path.join(DB_DIR, f))
 
-def upsert_proyecto(lista, nuevo):
+def cargar_datos():
+    # Solo metadatos (resumen sin items); los items se piden con detalle_items.
+    # Si el formato existente no coincide con DB_FORMAT se convierte. Los errores
+    # de lectura o conversión se propagan: no se muestran como BD vacía.
+    origen = _origen_datos()
+    if origen is None:
+        return []
+    if (origen == "parquet") != (DB_FORMAT == "parquet"):
+        _convertir_bd()
+    with _bloqueo_db(exclusivo=False):
+        return [_sin_items(p) for p in _leer_registros()]
+
+def cargar_items_proyecto(p: dict):
+    # None si la BD ya no tiene esta versión del proyecto (otra sesión lo reemplazó):
+    # quien llama debe refrescar sus metadatos, no mostrar el proyecto vacío
+    with _bloqueo_db(exclusivo=False):
+        reg = next((x for x in _leer_registros() if x.get("id") == p.get("id") and x.get("nombre") == p.get("nombre")), None)
+        if reg is None or safe_int(reg.get("version", 0)) != safe_int(p.get("version", 0)):
+            return None
+        if DB_FORMAT == "parquet":
+            path = _archivo_items(p)
+            if not os.path.exists(path):
+                return None
+            items = pd.read_parquet(path)
+        else:
+            items = reg.get("resumen", {}).get("items", [])
+    # BD vieja: limpia SERVICIO/SERVICIOS; los estatus siguen las reglas vigentes
+    return filtrar_items_servicios(aplicar_reglas(items_a_df(items)))
+
+def _escribir_bd(lista_proyectos):
+    # Reescritura completa (solo para convertir formatos); las cargas usan guardar_proyecto
+    if DB_FORMAT == "parquet":
+        for p in lista_proyectos:
+            _escribir_items_parquet(p)
+    _escribir_registros([_registro(p) for p in lista_proyectos])
+
+def guardar_proyecto(nuevo: dict, version_base=None, reemplazar=True) -> tuple[bool, str]:
+    # Fusiona un solo proyecto en la BD sin tocar los demás. Si otra sesión lo
+    # guardó después de `version_base`, no se escribe y se reporta el conflicto.
     nombre = nuevo["nombre"]
-    out = [p for p in lista if p.get("nombre") != nombre]
-    out.append(nuevo)
-    return out
-
-def dedup_items_por_clave(items, keys):
-    seen = set()
-    out = []
-    for it in items:
-        k = tuple(str(it.get(x, "")).strip() for x in keys)
-        if k in seen:
-            continue
-        seen.add(k)
-        out.append(it)
-    return out
+    # Los items van a un archivo propio (id único): se escriben fuera del lock
+    if DB_FORMAT == "parquet":
+        _escribir_items_parquet(nuevo)
+
+    with _bloqueo_db():
+        registros = _leer_registros()
+        previos = [p for p in registros if p.get("nombre") == nombre]
+        version_disco = max((safe_int(p.get("version", 0)) for p in previos), default=None)
+
+        if reemplazar and version_disco is not None and version_disco != safe_int(version_base or 0):
+            if DB_FORMAT == "parquet":
+                os.remove(_archivo_items(nuevo))
+            return False, (
+                f"Conflicto en '{nombre}': otra sesión lo guardó (versión {version_disco}, "
+                f"esta sesión tenía {version_base if version_base is not None else 'ninguna'}). "
+                "Se recargaron los datos; vuelve a subir el archivo si aún aplica."
+            )
+
+        nuevo["version"] = (version_disco or 0) + 1
+        if reemplazar:
+            registros = [p for p in registros if p.get("nombre") != nombre]
+        registros.append(_registro(nuevo))
+        _escribir_registros(registros)
+
+        if reemplazar and DB_FORMAT == "parquet":
+            for p in previos:
+                path = _archivo_items(p)
+                if path != _archivo_items(nuevo) and os.path.exists(path):
+                    os.remove(path)
+    return True, ""
+
+def guardar_agregados(p: dict, agregados: dict):
+    # Sella en la BD agregados recalculados para la misma versión del proyecto,
+    # así otras sesiones y reinicios no vuelven a leer sus items
+    with _bloqueo_db():
+        registros = _leer_registros()
+        reg = next((x for x in registros if x.get("id") == p.get("id") and x.get("nombre") == p.get("nombre")), None)
+        if reg is None or safe_int(reg.get("version", 0)) != safe_int(p.get("version", 0)):
+            return
+        reg.setdefault("resumen", {}).update(agregados)
+        _escribir_registros(registros)
+
+def dedup_items_por_clave(items: pd.DataFrame, keys) -> pd.DataFrame:
+    items = items_a_df(items)
+    keys = [k for k in keys if k in items.columns]
+    if items.empty or not keys:
+        return items
+    return items.drop_duplicates(subset=keys).reset_index(drop=True)
 
 # =========================
 # UTILIDADES
 # =========================
-def dias_restantes(fecha_prometida):
-    hoy = pd.Timestamp.today().normalize()
-    if pd.isna(fecha_prometida):
-        return None
-    return int((pd.Timestamp(fecha_prometida).normalize() - hoy).days)
-
 def safe_int(x, default=0):
     try:
         return int(x)
     except:
         return default
 
-def is_empty_oc(v):
-    if pd.isna(v):
-        return True
-    s = str(v).strip().lower()
-    return s in ["", "0", "0.0", "nan", "none"]
-
-def item_es_servicio(it: dict) -> bool:
-    desc = str(it.get("descripcion", "") or "")
-    return bool(SERVICIO_RE.search(desc))
-
-def filtrar_items_servicios(items: list) -> list:
-    return [it for it in (items or []) if not item_es_servicio(it)]
+def filtrar_items_servicios(items: pd.DataFrame) -> pd.DataFrame:
+    items = items_a_df(items)
+    if items.empty:
+        return items
+    mask = mascara_exclusion(items["descripcion"])
+    if not mask.any():
+        return items
+    return items[~mask].reset_index(drop=True)
 
 def style_light_table(df: pd.DataFrame):
     # st.dataframe soporta pandas.Styler [web:425]
@@ -110,45 +278,278 @@ def style_light_table(df: pd.DataFrame):
     )
 
 # =========================
-# ESTADO
+# ITEMS (columnar en memoria)
 # =========================
-if "proyectos" not in st.session_state:
-    st.session_state.proyectos = cargar_datos()
-if "modo" not in st.session_state:
-    st.session_state.modo = None
-if "admin_ok" not in st.session_state:
-    st.session_state.admin_ok = False
+ITEM_COLS_EXCEL = {
+    "NO. S.C.": "no_sc",
+    "TITULO DE LA REQUISICION": "titulo",
+    "DESCRIPCION DE LA PARTIDA": "descripcion",
+    "ESTATUS S.C.": "estatus_sc_raw",
+    "ESTATUS O.C.": "estatus_oc_raw",
+    "NO. O.C.": "no_oc",
+    "FECHA PROMETIDA": "fecha_prometida",
+    "FECHA DE LLEGADA": "fecha_llegada",
+}
+ITEM_CAMPOS = list(ITEM_COLS_EXCEL.values()) + ["estatus_sc", "estatus_oc"]
+# Valores muy repetidos: se guardan como categorías (un código por fila)
+ITEM_CATEGORICAS = ["no_sc", "titulo", "estatus_sc_raw", "estatus_oc_raw", "no_oc", "estatus_sc", "estatus_oc"]
+ITEM_FECHAS = ["fecha_prometida", "fecha_llegada"]
+
+def _a_texto(v) -> str:
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))  # 5000.0 -> "5000"
+    return str(v).strip()
+
+def _por_valor_unico(s: pd.Series, fn) -> np.ndarray:
+    # Evalúa fn (por columnas) solo sobre los valores distintos y reparte por códigos
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        codes, uniques = s.cat.codes.to_numpy(), s.cat.categories
+    else:
+        codes, uniques = pd.factorize(s)
+    textos = pd.Series([_a_texto(v) for v in uniques] + [""], dtype=object)
+    return np.asarray(fn(textos), dtype=object)[codes]  # código -1 (NaN) -> ""
+
+def _texto(s: pd.Series) -> pd.Series:
+    return pd.Series(_por_valor_unico(s, lambda t: t), index=s.index, dtype=object)
+
+def _texto_upper(s: pd.Series) -> pd.Series:
+    return pd.Series(_por_valor_unico(s, lambda t: t.str.upper()), index=s.index, dtype=object)
+
+def items_a_df(items) -> pd.DataFrame:
+    if isinstance(items, pd.DataFrame) and list(items.columns) == ITEM_CAMPOS:
+        return items
+    df = pd.DataFrame(items if items is not None else [])
+    n = len(df)
+    derivar_estatus = "estatus_sc" not in df.columns
+    out = {}
+    for c in ITEM_CAMPOS:
+        col = df[c] if c in df.columns else pd.Series([None] * n, index=df.index, dtype=object)
+        if c in ITEM_FECHAS:
+            out[c] = pd.to_datetime(col, errors="coerce")
+        elif c in ITEM_CATEGORICAS:
+            out[c] = _texto(col).astype("category")
+        else:
+            out[c] = _texto(col)
+    df = pd.DataFrame(out, index=df.index).reset_index(drop=True)
+    if derivar_estatus:
+        df = aplicar_reglas(df)
+    return df
 
-if "login_choice" not in st.session_state:
-    st.session_state.login_choice = None
-if "login_error" not in st.session_state:
-    st.session_state.login_error = ""
+# Columnas internas -> encabezados de la tabla completa
+TABLA_COMPLETA_COLS = {
+    "no_sc": "No. S.C.",
+    "titulo": "Título",
+    "descripcion": "Descripción",
+    "no_oc": "No. O.C.",
+    "estatus_sc": "Estatus S.C.",
+    "estatus_oc": "Estatus O.C.",
+    "fecha_prometida": "Fecha prometida",
+    "fecha_llegada": "Fecha llegada",
+}
+
+def items_a_registros(items) -> list:
+    if items is None:
+        return []
+    if not isinstance(items, pd.DataFrame):
+        return list(items)
+    return items.astype({c: object for c in ITEM_CATEGORICAS if c in items.columns}).to_dict("records")
+
+def contar_sin_oc(items: pd.DataFrame) -> int:
+    if items.empty:
+        return 0
+    return int(mascara_oc_vacia(items["no_oc"]).sum())
+
+# =========================
+# REGLAS DE CLASIFICACIÓN
+# =========================
+# Se ajustan sin tocar código con un JSON en REGLAS_FILE, por ejemplo:
+#   {"estatus_oc": {"X": "CANCELADO"}, "oc_vacia": ["0", "0.0", "nan", "none", "S/N"],
+#    "plantas": {"ALTAMIRA": {"exclusiones": ["\\bSERVICI", "\\bFLETE"]}}}
+# Las tablas de códigos se fusionan con las de base; las listas se reemplazan.
+# Una O.C. vacía o NaN siempre cuenta como "SIN OC", esté o no "" en oc_vacia.
+# PLANTA elige qué bloque de "plantas" aplica a esta instancia.
+REGLAS_FILE = os.getenv("REGLAS_FILE", "reglas_clasificacion.json")
+PLANTA = os.getenv("PLANTA", "").strip()
+
+ESTADOS_ORDEN = ["COMPLETADO", "PENDIENTE A LLEGAR", "SIN PEDIDO", "CANCELADO"]
+
+REGLAS_BASE = {
+    "estatus_sc": {"A": "COMPLETADO", "Q": "SIN PEDIDO", "U": "CANCELADO"},
+    "estatus_oc": {"A": "COMPLETADO", "C": "CANCELADO"},
+    "estatus_default": "PENDIENTE A LLEGAR",
+    "oc_vacia": ["", "0", "0.0", "nan", "none"],
+    # Detecta: SERVICIO / SERVICIOS / SERVICIO-PRECIO FIJO / etc.
+    "exclusiones": [r"\bSERVICI"],
+}
+
+def _fusionar_reglas(base: dict, extra: dict) -> dict:
+    out = dict(base)
+    for k, v in (extra or {}).items():
+        if k == "plantas":
+            continue
+        out[k] = {**out.get(k, {}), **v} if isinstance(v, dict) else v
+    return out
+
+def cargar_reglas() -> dict:
+    cfg = {}
+    if os.path.exists(REGLAS_FILE):
+        with open(REGLAS_FILE, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+    reglas = _fusionar_reglas(REGLAS_BASE, cfg)
+    if PLANTA:
+        reglas = _fusionar_reglas(reglas, cfg.get("plantas", {}).get(PLANTA, {}))
+    return reglas
+
+def compilar_reglas(reglas: dict) -> dict:
+    def tabla(codigos: dict):
+        codigos = {str(k).strip().upper(): v for k, v in codigos.items()}
+        # El último lugar es el estatus por omisión (get_indexer devuelve -1)
+        estados = np.array(list(codigos.values()) + [reglas["estatus_default"]], dtype=object)
+        return pd.Index(list(codigos)), estados
+
+    patrones = [p for p in reglas.get("exclusiones", []) if p]
+    return {
+        "estatus_sc": tabla(reglas["estatus_sc"]),
+        "estatus_oc": tabla(reglas["estatus_oc"]),
+        "oc_vacia": pd.Index(sorted({""} | {str(t).strip().lower() for t in reglas["oc_vacia"]})),
+        "exclusion": re.compile("|".join(f"(?:{p})" for p in patrones), re.IGNORECASE) if patrones else None,
+    }
+
+@st.cache_resource(show_spinner=False)
+def _reglas_compiladas(version: str) -> dict:
+    return compilar_reglas(cargar_reglas())
+
+def reglas_version() -> str:
+    # Cambia al editar el archivo de reglas: se recompilan sin reiniciar
+    mtime = os.path.getmtime(REGLAS_FILE) if os.path.exists(REGLAS_FILE) else 0
+    return f"{PLANTA}|{mtime}"
+
+def reglas() -> dict:
+    return _reglas_compiladas(reglas_version())
+
+def _mapear_estatus(s: pd.Series, tabla) -> pd.Series:
+    codigos, estados = tabla
+    vals = _por_valor_unico(s, lambda t: estados[codigos.get_indexer(t.str.upper())])
+    return pd.Series(vals, index=s.index, dtype="category")
+
+def mapear_estatus_sc(s: pd.Series) -> pd.Series:
+    return _mapear_estatus(s, reglas()["estatus_sc"])
+
+def mapear_estatus_oc(s: pd.Series) -> pd.Series:
+    return _mapear_estatus(s, reglas()["estatus_oc"])
+
+def mascara_oc_vacia(s: pd.Series) -> np.ndarray:
+    tokens = reglas()["oc_vacia"]
+    return _por_valor_unico(s, lambda t: t.str.lower().isin(tokens)).astype(bool)
+
+def mascara_exclusion(s: pd.Series) -> np.ndarray:
+    patron = reglas()["exclusion"]
+    if patron is None:
+        return np.zeros(len(s), dtype=bool)
+    return _por_valor_unico(s, lambda t: t.str.contains(patron, na=False)).astype(bool)
+
+def aplicar_reglas(items: pd.DataFrame) -> pd.DataFrame:
+    # Estatus mapeados desde los códigos crudos con las reglas vigentes
+    items = items.copy()
+    items["estatus_sc"] = mapear_estatus_sc(items["estatus_sc_raw"])
+    items["estatus_oc"] = mapear_estatus_oc(items["estatus_oc_raw"])
+    return items
+
+def clase_general(items: pd.DataFrame) -> np.ndarray:
+    est_sc = _texto_upper(items["estatus_sc"])
+    est_oc = _texto_upper(items["estatus_oc"])
+    sin_oc = mascara_oc_vacia(items["no_oc"])
+    cancelado = est_sc.str.contains("CANCEL", regex=False) | est_oc.str.contains("CANCEL", regex=False)
+    completado = (est_sc == "COMPLETADO") | (est_oc == "COMPLETADO")
+    return np.select(
+        [sin_oc, cancelado.to_numpy(), completado.to_numpy()],
+        ["SIN OC", "CANCELADO", "COMPLETADO"],
+        default="PENDIENTE A LLEGAR",
+    )
 
 # =========================
 # LECTURA EXCEL
 # =========================
-def leer_nombre_proyecto_excel(file_bytes: bytes) -> str:
-    df0 = pd.read_excel(BytesIO(file_bytes), header=None, engine="openpyxl")
-    nombre = str(df0.iloc[3, 2]).strip()  # C4
+def leer_hojas_excel(file_bytes: bytes) -> dict:
+    # Un solo parseo del libro: todas las hojas en crudo (sin encabezado)
+    return pd.read_excel(BytesIO(file_bytes), sheet_name=None, header=None, engine="openpyxl")
+
+def nombre_proyecto_hoja(raw: pd.DataFrame) -> str:
+    if raw.shape[0] < 4 or raw.shape[1] < 3:
+        return ""
+    nombre = str(raw.iloc[3, 2]).strip()  # C4
     nombre = nombre.replace("NOMBRE DEL PROYECTO", "").replace(":", "").strip()
     if nombre.lower() in ["nan", "none", ""]:
-        return "PROYECTO_SIN_NOMBRE"
+        return ""
     return nombre
 
-def leer_tabla_excel(file_bytes: bytes) -> pd.DataFrame:
-    raw = pd.read_excel(BytesIO(file_bytes), header=None, engine="openpyxl")
-    header_row = None
-    for i in range(len(raw)):
-        row = raw.iloc[i].astype(str).tolist()
-        if "No. S.C." in row:
-            header_row = i
-            break
-    if header_row is None:
+def fila_encabezado_hoja(raw: pd.DataFrame):
+    filas = raw.isin(["No. S.C."]).any(axis=1)
+    return int(filas.to_numpy().argmax()) if filas.any() else None
+
+def _encabezados(valores) -> list:
+    # Igual que read_excel: sin saltos de línea y con sufijo .1, .2 en repetidos
+    out, vistos = [], {}
+    for i, v in enumerate(valores):
+        c = f"Unnamed: {i}" if pd.isna(v) else str(v).replace("\n", " ").strip()
+        n = vistos.get(c, 0)
+        vistos[c] = n + 1
+        out.append(f"{c}.{n}" if n else c)
+    return out
+
+def tabla_de_hoja(raw: pd.DataFrame, header_row: int) -> pd.DataFrame:
+    df = raw.iloc[header_row + 1:].dropna(how="all").reset_index(drop=True)
+    df.columns = _encabezados(raw.iloc[header_row].tolist())
+    return df.infer_objects()
+
+def procesar_hoja(raw: pd.DataFrame, header_row: int, do_dedup=True) -> dict:
+    df = filtrar_servicios(tabla_de_hoja(raw, header_row))  # <-- SERVICIO/SERVICIOS fuera desde carga
+    resumen = procesar_resumen(df)
+    if do_dedup:
+        resumen["items"] = dedup_items_por_clave(resumen["items"], keys=["no_sc", "descripcion", "no_oc"])
+    return resumen
+
+def procesar_libro(file_bytes: bytes, do_dedup=True) -> list:
+    # Devuelve [(hoja, nombre, resumen | Exception)] de cada hoja con proyecto (C4 + 'No. S.C.')
+    hojas = leer_hojas_excel(file_bytes)
+    candidatas = []
+    for hoja, raw in hojas.items():
+        header_row = fila_encabezado_hoja(raw)
+        if header_row is not None:
+            candidatas.append((hoja, nombre_proyecto_hoja(raw), raw, header_row))
+    if not candidatas:
         raise ValueError("No se encontró el encabezado 'No. S.C.' en el Excel.")
+    if len(candidatas) == 1:
+        hoja, nombre, raw, header_row = candidatas[0]
+        candidatas = [(hoja, nombre or "PROYECTO_SIN_NOMBRE", raw, header_row)]
+
+    # Con varias hojas cada una necesita su nombre (C4) y no puede repetirse en el libro:
+    # esas hojas se reportan como error en vez de descartarse o pisarse entre sí
+    errores, validas, primera = [], [], {}
+    for hoja, nombre, raw, header_row in candidatas:
+        if not nombre:
+            errores.append((hoja, "", ValueError("falta nombre en C4")))
+        elif nombre in primera:
+            errores.append((hoja, nombre, ValueError(f"nombre repetido en el libro (ya está en la hoja '{primera[nombre]}')")))
+        else:
+            primera[nombre] = hoja
+            validas.append((hoja, nombre, raw, header_row))
+    if not validas:
+        hojas_txt = ", ".join(str(h) for h, _, _ in errores)
+        raise ValueError(f"Ninguna hoja con 'No. S.C.' tiene nombre de proyecto en C4 (hojas: {hojas_txt}).")
+
+    def _uno(c):
+        hoja, nombre, raw, header_row = c
+        try:
+            return hoja, nombre, procesar_hoja(raw, header_row, do_dedup)
+        except Exception as e:
+            return hoja, nombre, e
 
-    df = pd.read_excel(BytesIO(file_bytes), header=header_row, engine="openpyxl")
-    df.columns = [str(c).replace("\n", " ").strip() for c in df.columns]
-    return df
+    with ThreadPoolExecutor(max_workers=min(len(validas), os.cpu_count() or 1)) as pool:
+        resultados = {r[0]: r for r in list(pool.map(_uno, validas)) + errores}
+    return [resultados[c[0]] for c in candidatas]  # en el orden de las hojas
 
 def filtrar_servicios(df: pd.DataFrame) -> pd.DataFrame:
     col_desc = "DESCRIPCION DE LA PARTIDA"
@@ -159,73 +560,83 @@ def filtrar_servicios(df: pd.DataFrame) -> pd.DataFrame:
         else:
             raise ValueError("No existe la columna 'DESCRIPCION DE LA PARTIDA'.")
 
-    # Quita SERVICIO, SERVICIOS, SERVICIO-..., etc. (por regex)
-    mask = df[col_desc].astype(str).str.contains(r"\bSERVICI", case=False, na=False, regex=True)
+    # Quita SERVICIO, SERVICIOS, SERVICIO-..., etc. (reglas de exclusión)
+    mask = mascara_exclusion(df[col_desc])
     return df[~mask].copy()
 
-# =========================
-# ESTATUS
-# =========================
-ESTADOS_ORDEN = ["COMPLETADO", "PENDIENTE A LLEGAR", "SIN PEDIDO", "CANCELADO"]
-
-def map_estatus_sc(valor):
-    v = str(valor).strip().upper()
-    if v == "A":
-        return "COMPLETADO"
-    if v == "Q":
-        return "SIN PEDIDO"
-    if v == "U":
-        return "CANCELADO"
-    return "PENDIENTE A LLEGAR"
-
-def map_estatus_oc(valor):
-    v = str(valor).strip().upper()
-    if v == "A":
-        return "COMPLETADO"
-    if v == "C":
-        return "CANCELADO"
-    return "PENDIENTE A LLEGAR"
-
 # =========================
 # RESUMEN (dona + tendencia semanal)
 # =========================
-def clase_general_from_item(it: dict) -> str:
-    no_oc = it.get("no_oc", "")
-    est_sc = str(it.get("estatus_sc", "")).upper().strip()
-    est_oc = str(it.get("estatus_oc", "")).upper().strip()
-
-    if is_empty_oc(no_oc):
-        return "SIN OC"
-    if "CANCEL" in est_sc or "CANCEL" in est_oc:
-        return "CANCELADO"
-    if est_sc == "CANCELADO" or est_oc == "CANCELADO":
-        return "CANCELADO"
-    if est_sc == "COMPLETADO" or est_oc == "COMPLETADO":
-        return "COMPLETADO"
-    return "PENDIENTE A LLEGAR"
-
-def construir_conteo_general_y_trend_desde_items(items: list) -> tuple[dict, list]:
-    items = filtrar_items_servicios(items)
-    if not items:
+def mascara_cancelados(df: pd.DataFrame) -> pd.Series:
+    return (
+        (_texto_upper(df["estatus_sc"]) == "CANCELADO") | (_texto_upper(df["estatus_oc"]) == "CANCELADO")
+        | _texto_upper(df["estatus_sc_raw"]).str.contains("CANCEL", regex=False)
+        | _texto_upper(df["estatus_oc_raw"]).str.contains("CANCEL", regex=False)
+    )
+
+def construir_conteo_general_y_trend_desde_items(items: pd.DataFrame) -> tuple[dict, list]:
+    df = filtrar_items_servicios(items)
+    if df.empty:
         return {}, []
 
-    df = pd.DataFrame(items).copy()
-    df["clase_general"] = df.apply(lambda r: clase_general_from_item(r.to_dict()), axis=1)
-    conteo_general = df["clase_general"].value_counts(dropna=False).to_dict()
+    conteo_general = pd.Series(clase_general(df)).value_counts(dropna=False).to_dict()
 
     trend = []
-    if "fecha_prometida" in df.columns:
-        df["fecha_prometida_dt"] = pd.to_datetime(df["fecha_prometida"], errors="coerce")
-        dft = df[pd.notnull(df["fecha_prometida_dt"])].copy()
-        if not dft.empty:
-            g = dft.groupby(pd.Grouper(key="fecha_prometida_dt", freq="W-MON")).agg(
-                solicitudes=("fecha_prometida_dt", "size")
-            ).reset_index()
-            g = g.rename(columns={"fecha_prometida_dt": "SEMANA"})
-            trend = g.to_dict("records")
+    dft = df.loc[df["fecha_prometida"].notna(), ["fecha_prometida"]]
+    if not dft.empty:
+        g = dft.groupby(pd.Grouper(key="fecha_prometida", freq="W-MON")).agg(
+            solicitudes=("fecha_prometida", "size")
+        ).reset_index()
+        g = g.rename(columns={"fecha_prometida": "SEMANA"})
+        trend = g.to_dict("records")
 
     return conteo_general, trend
 
+# Entregas por semana de fecha prometida (misma semana que la tendencia).
+# Solo conteos y sumas: se combinan entre semanas/proyectos sumando bins.
+RETRASO_RANGOS = [  # (columna, etiqueta, días de retraso hasta)
+    ("tarde_1_7", "1-7 días", 7),
+    ("tarde_8_14", "8-14 días", 14),
+    ("tarde_15_30", "15-30 días", 30),
+    ("tarde_mas_30", "> 30 días", None),
+]
+ENTREGAS_COLS = ["a_tiempo"] + [c for c, _, _ in RETRASO_RANGOS] + ["dias_retraso", "abiertos"]
+
+def construir_bins_entrega(items: pd.DataFrame) -> list:
+    df = filtrar_items_servicios(items)
+    df = df.loc[df["fecha_prometida"].notna() & ~mascara_cancelados(df), ["fecha_prometida", "fecha_llegada"]]
+    if df.empty:
+        return []
+
+    retraso = (df["fecha_llegada"].dt.normalize() - df["fecha_prometida"].dt.normalize()).dt.days
+    llego = df["fecha_llegada"].notna()
+    tarde = llego & (retraso > 0)
+
+    b = pd.DataFrame({"fecha_prometida": df["fecha_prometida"]})
+    b["a_tiempo"] = llego & (retraso <= 0)
+    desde = 0
+    for col, _, hasta in RETRASO_RANGOS:
+        b[col] = tarde & (retraso > desde) & ((retraso <= hasta) if hasta is not None else True)
+        desde = hasta
+    b["dias_retraso"] = retraso.where(tarde, 0)
+    b["abiertos"] = ~llego
+
+    g = b.groupby(pd.Grouper(key="fecha_prometida", freq="W-MON"))[ENTREGAS_COLS].sum().astype(int)
+    g = g.loc[g.any(axis=1)].reset_index().rename(columns={"fecha_prometida": "SEMANA"})
+    return g.to_dict("records")
+
+def agregados_desde_items(items: pd.DataFrame) -> dict:
+    # Todo lo que depende de las reglas de clasificación; se sella con su versión
+    conteo_general, trend = construir_conteo_general_y_trend_desde_items(items)
+    return {
+        "total_registros": int(len(items)),  # ojo: ya sin servicios
+        "sin_oc_real": contar_sin_oc(items),
+        "conteo_general": {k: safe_int(v) for k, v in conteo_general.items()},
+        "trend": trend,
+        "entregas": construir_bins_entrega(items),
+        "reglas_version": reglas_version(),
+    }
+
 def procesar_resumen(df: pd.DataFrame) -> dict:
     df2 = df.copy()
     df2.columns = [str(c).strip().upper() for c in df2.columns]
@@ -237,13 +648,13 @@ def procesar_resumen(df: pd.DataFrame) -> dict:
         total_disponible = 0
 
     if "ESTATUS S.C." in df2.columns:
-        sc_cat = df2["ESTATUS S.C."].apply(map_estatus_sc)
+        sc_cat = mapear_estatus_sc(df2["ESTATUS S.C."])
         conteo_sc = sc_cat.value_counts(dropna=False).to_dict()
     else:
         conteo_sc = {}
 
     if "ESTATUS O.C." in df2.columns:
-        oc_cat = df2["ESTATUS O.C."].apply(map_estatus_oc)
+        oc_cat = mapear_estatus_oc(df2["ESTATUS O.C."])
         conteo_oc = oc_cat.value_counts(dropna=False).to_dict()
     else:
         conteo_oc = {}
@@ -255,70 +666,286 @@ def procesar_resumen(df: pd.DataFrame) -> dict:
         if col in df2.columns:
             df2[col] = pd.to_datetime(df2[col], errors="coerce")
 
-    # Críticos
-    criticos = []
-    hoy = pd.Timestamp.now()
-
-    if "FECHA PROMETIDA" in df2.columns and "FECHA DE LLEGADA" in df2.columns:
-        for _, row in df2.iterrows():
-            est_sc_raw = str(row.get("ESTATUS S.C.", "")).upper().strip()
-            est_oc_raw = str(row.get("ESTATUS O.C.", "")).upper().strip()
-
-            es_cancelado = (est_sc_raw == "U") or (est_oc_raw == "C") or ("CANCEL" in est_sc_raw) or ("CANCEL" in est_oc_raw)
-            fecha_prom = row.get("FECHA PROMETIDA", pd.NaT)
-            fecha_lleg = row.get("FECHA DE LLEGADA", pd.NaT)
-
-            vencido = False
-            if pd.notnull(fecha_prom) and pd.isnull(fecha_lleg) and fecha_prom < hoy:
-                vencido = True
-
-            if es_cancelado or vencido:
-                criticos.append({
-                    "No. S.C.": row.get("NO. S.C.", "-"),
-                    "Título": row.get("TITULO DE LA REQUISICION", "Sin título"),
-                    "Estatus S.C.": map_estatus_sc(row.get("ESTATUS S.C.", "")),
-                    "Estatus O.C.": map_estatus_oc(row.get("ESTATUS O.C.", "")),
-                    "Fecha prometida": fecha_prom.strftime("%d/%m/%Y") if pd.notnull(fecha_prom) else "-"
-                })
+    # Los críticos ya no se congelan aquí: se calculan al ver (calcular_criticos)
 
     # Items persistidos
-    items = []
-    cols = {
-        "NO. S.C.": "no_sc",
-        "TITULO DE LA REQUISICION": "titulo",
-        "DESCRIPCION DE LA PARTIDA": "descripcion",
-        "ESTATUS S.C.": "estatus_sc_raw",
-        "ESTATUS O.C.": "estatus_oc_raw",
-        "NO. O.C.": "no_oc",
-        "FECHA PROMETIDA": "fecha_prometida",
-        "FECHA DE LLEGADA": "fecha_llegada",
-    }
-    for _, row in df2.iterrows():
-        it = {}
-        for k, outk in cols.items():
-            it[outk] = row.get(k, "")
-        it["estatus_sc"] = map_estatus_sc(it.get("estatus_sc_raw", ""))
-        it["estatus_oc"] = map_estatus_oc(it.get("estatus_oc_raw", ""))
-        items.append(it)
-
+    items = items_a_df(df2.reindex(columns=list(ITEM_COLS_EXCEL)).rename(columns=ITEM_COLS_EXCEL))
     items = dedup_items_por_clave(items, keys=["no_sc", "descripcion", "no_oc"])
     items = filtrar_items_servicios(items)  # seguridad extra
 
-    sin_oc_real = int(pd.Series([x.get("no_oc", None) for x in items]).apply(is_empty_oc).sum()) if items else 0
-    conteo_general, trend = construir_conteo_general_y_trend_desde_items(items)
-
     return {
-        "total_registros": int(len(items)),  # ojo: ya sin servicios
         "total_disponible": float(total_disponible),
         "conteo_sc": conteo_sc,
         "conteo_oc": conteo_oc,
-        "criticos": criticos,
         "items": items,
-        "sin_oc_real": sin_oc_real,
-        "conteo_general": {k: safe_int(v) for k, v in conteo_general.items()},
-        "trend": trend
+        **agregados_desde_items(items),
     }
 
+# =========================
+# CRÍTICOS (se calculan al ver, por columnas)
+# =========================
+AVANCE_VENTANA_DIAS = 30
+CRITICOS_COLS = ["No. S.C.", "Título", "Estatus S.C.", "Estatus O.C.", "Fecha prometida", "Avance %", "Detalle avance"]
+
+def calcular_criticos(items: pd.DataFrame, hoy: pd.Timestamp) -> pd.DataFrame:
+    df = items_a_df(items)
+    if df.empty:
+        return pd.DataFrame(columns=CRITICOS_COLS)
+
+    hoy = pd.Timestamp(hoy).normalize()
+
+    est_sc = _texto_upper(df["estatus_sc"])
+    est_oc = _texto_upper(df["estatus_oc"])
+    es_cancelado = mascara_cancelados(df)
+
+    fecha_prom = df["fecha_prometida"].dt.normalize()
+    fecha_lleg = df["fecha_llegada"]
+    vencido = fecha_prom.notna() & fecha_lleg.isna() & (fecha_prom < hoy)
+
+    mask = es_cancelado | vencido
+    if not mask.any():
+        return pd.DataFrame(columns=CRITICOS_COLS)
+
+    est_sc = est_sc[mask]
+    est_oc = est_oc[mask]
+    fecha_prom = fecha_prom[mask]
+    dias = (fecha_prom - hoy).dt.days
+
+    completado = (est_sc == "COMPLETADO") & (est_oc == "COMPLETADO")
+    cancelado = (est_sc == "CANCELADO") | (est_oc == "CANCELADO")
+    sin_fecha = dias.isna()
+    atrasado = dias < 0
+    dias_txt = dias.fillna(0).astype(int)
+
+    pct = (AVANCE_VENTANA_DIAS - dias.clip(upper=AVANCE_VENTANA_DIAS)) * 100 / AVANCE_VENTANA_DIAS
+    pct = pct.clip(0, 100).fillna(0).astype(int)
+    condiciones = [completado, cancelado, sin_fecha, atrasado]
+    avance = np.select(condiciones, [100, 0, 5, 0], default=pct)
+    detalle = np.select(
+        condiciones,
+        ["Completado", "Cancelado", "Sin fecha", "Vencido " + dias_txt.abs().astype(str) + " días"],
+        default=dias_txt.astype(str) + " días restantes",
+    )
+
+    sub = df[mask]
+    return pd.DataFrame({
+        "No. S.C.": sub["no_sc"],
+        "Título": sub["titulo"],
+        "Estatus S.C.": est_sc,
+        "Estatus O.C.": est_oc,
+        "Fecha prometida": fecha_prom.dt.strftime("%d/%m/%Y").fillna("-"),
+        "Avance %": avance.astype(int),
+        "Detalle avance": detalle,
+    }, index=sub.index)[CRITICOS_COLS].reset_index(drop=True)
+
+def clave_proyecto(p: dict) -> str:
+    # Los estatus dependen de las reglas vigentes: también forman parte de la clave
+    return f"{p.get('id', p.get('nombre', ''))}|{p.get('fecha_carga', '')}|{p.get('version', 0)}|{reglas_version()}"
+
+# =========================
+# DETALLE DE PROYECTOS (LRU con tope de memoria)
+# =========================
+# Items, críticos y archivos exportados viven en un cache del proceso, compartido por las sesiones.
+# Al pasar DETALLE_MEMORIA_MB se desaloja lo menos usado; se relee de la BD al pedirlo.
+DETALLE_MEMORIA_MB = float(os.getenv("DETALLE_MEMORIA_MB", "256"))
+
+@st.cache_resource(show_spinner=False)
+def _cache_detalle() -> dict:
+    return {"lock": threading.Lock(), "entradas": OrderedDict(), "bytes": 0, "aciertos": 0, "fallos": 0, "desalojos": 0}
+
+def _bytes_df(df) -> int:
+    return int(df.memory_usage(deep=True).sum()) if df is not None else 0
+
+def _ajustar_presupuesto(c: dict):
+    # La entrada más reciente (al final) nunca se desaloja
+    limite = DETALLE_MEMORIA_MB * 1024 * 1024
+    while c["bytes"] > limite and len(c["entradas"]) > 1:
+        _, e = c["entradas"].popitem(last=False)
+        c["bytes"] -= e["bytes"]
+        c["desalojos"] += 1
+
+def detalle_proyecto(p: dict):
+    # Entrada del LRU (items + críticos del día); una consulta por vista del proyecto
+    c = _cache_detalle()
+    clave = clave_proyecto(p)
+    with c["lock"]:
+        e = c["entradas"].get(clave)
+        if e is not None:
+            c["entradas"].move_to_end(clave)
+            c["aciertos"] += 1
+            return e
+        c["fallos"] += 1
+
+    # Lectura fuera del lock: no bloquea a otras sesiones
+    items = cargar_items_proyecto(p)
+    if items is None:
+        return None
+    e = {"clave": clave, "items": items, "criticos": None, "dia": None, "exportes": {}, "bytes": _bytes_df(items)}
+    with c["lock"]:
+        previa = c["entradas"].pop(clave, None)
+        if previa is not None:
+            c["bytes"] -= previa["bytes"]
+        c["entradas"][clave] = e
+        c["bytes"] += e["bytes"]
+        _ajustar_presupuesto(c)
+    return e
+
+def detalle_items(p: dict):
+    # None si los metadatos de la sesión quedaron viejos (ver cargar_items_proyecto)
+    e = detalle_proyecto(p)
+    return e["items"] if e is not None else None
+
+def _sumar_bytes(c: dict, e: dict, delta: int):
+    # Con el lock tomado; solo cuenta para el tope si la entrada sigue en el LRU
+    e["bytes"] += delta
+    if c["entradas"].get(e["clave"]) is e:
+        c["bytes"] += delta
+        _ajustar_presupuesto(c)
+
+def detalle_criticos(e: dict, dia: str) -> pd.DataFrame:
+    # Críticos del día sobre una entrada ya consultada: se recalculan al cambiar de día
+    if e["dia"] != dia:
+        dfc = calcular_criticos(e["items"], pd.Timestamp(dia))
+        c = _cache_detalle()
+        with c["lock"]:
+            if e["dia"] != dia:
+                delta = _bytes_df(dfc) - (_bytes_df(e["criticos"]) if e["criticos"] is not None else 0)
+                # Las descargas de críticos de otro día ya no sirven
+                for k in [k for k in e["exportes"] if k[0] == "criticos" and k[1] != dia]:
+                    delta -= len(e["exportes"].pop(k))
+                e["criticos"], e["dia"] = dfc, dia
+                _sumar_bytes(c, e, delta)
+    return e["criticos"]
+
+def estadisticas_detalle() -> dict:
+    c = _cache_detalle()
+    with c["lock"]:
+        return {
+            "mb": c["bytes"] / 1024 / 1024,
+            "proyectos": len(c["entradas"]),
+            "aciertos": c["aciertos"],
+            "fallos": c["fallos"],
+            "desalojos": c["desalojos"],
+        }
+
+@st.cache_resource(show_spinner=False)
+def _agregados_recalculados() -> dict:
+    # Por clave_proyecto (incluye la versión de reglas), compartido entre sesiones
+    return {"lock": threading.Lock(), "por_clave": OrderedDict()}
+
+def resumen_vigente(p: dict, items: pd.DataFrame = None) -> dict:
+    # Los items se re-clasifican con las reglas vigentes al cargarse; si las reglas
+    # cambiaron desde la carga (o es BD vieja sin sello) los agregados se recalculan
+    # una vez por proceso y se guardan en la BD
+    r = p.setdefault("resumen", {})
+    if r.get("reglas_version") == reglas_version():
+        return r
+
+    clave = clave_proyecto(p)
+    c = _agregados_recalculados()
+    with c["lock"]:
+        agregados = c["por_clave"].get(clave)
+    if agregados is None:
+        items = detalle_items(p) if items is None else items
+        if items is None:
+            return r
+        agregados = agregados_desde_items(items)
+        guardar_agregados(p, agregados)
+        with c["lock"]:
+            c["por_clave"][clave] = agregados
+            while len(c["por_clave"]) > 1024:
+                c["por_clave"].popitem(last=False)
+    r.update(agregados)
+    return r
+
+# =========================
+# ENTREGAS (combinación de bins semanales)
+# =========================
+ENTREGAS_VENTANAS = ["Semanal", "Mensual", "Móvil 4 semanas"]
+
+def bins_entrega(p: dict) -> list:
+    return resumen_vigente(p).get("entregas", [])
+
+def combinar_entregas(listas_bins: list, ventana: str) -> pd.DataFrame:
+    registros = [b for bins in listas_bins for b in bins]
+    if not registros:
+        return pd.DataFrame(columns=["PERIODO"] + ENTREGAS_COLS)
+
+    df = pd.DataFrame(registros).reindex(columns=["SEMANA"] + ENTREGAS_COLS)
+    df["SEMANA"] = pd.to_datetime(df["SEMANA"], errors="coerce")
+    df[ENTREGAS_COLS] = df[ENTREGAS_COLS].apply(pd.to_numeric, errors="coerce").fillna(0).astype(int)
+    g = df.dropna(subset=["SEMANA"]).groupby("SEMANA")[ENTREGAS_COLS].sum()
+    if g.empty:
+        return pd.DataFrame(columns=["PERIODO"] + ENTREGAS_COLS)
+
+    if ventana == "Mensual":
+        # Cada semana cuenta en el mes de su etiqueta (lunes de cierre)
+        g = g.groupby(g.index.to_period("M")).sum()
+        g.index = g.index.to_timestamp()
+    elif ventana == "Móvil 4 semanas":
+        g = g.reindex(pd.date_range(g.index.min(), g.index.max(), freq="W-MON"), fill_value=0)
+        g = g.rolling(4, min_periods=1).sum().astype(int)
+    g.index.name = "PERIODO"
+    return g.reset_index()
+
+# =========================
+# EXPORTACIÓN (xlsx / csv)
+# =========================
+EXPORT_MIME = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+}
+
+def _filas(df: pd.DataFrame, bloque=5000):
+    # Recorre por bloques para no materializar toda la tabla como objetos
+    for i in range(0, len(df), bloque):
+        parte = df.iloc[i:i + bloque].astype(object)
+        parte = parte.where(parte.notna(), None)
+        yield from parte.itertuples(index=False, name=None)
+
+def exportar_tabla(df: pd.DataFrame, formato: str, hoja="Datos") -> bytes:
+    buf = BytesIO()
+    if formato == "xlsx":
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(hoja[:31])
+        ws.append(list(df.columns))
+        for fila in _filas(df):
+            ws.append(fila)
+        wb.save(buf)
+    else:
+        # utf-8-sig para que Excel abra bien los acentos
+        texto = TextIOWrapper(buf, encoding="utf-8-sig", newline="")
+        writer = csv.writer(texto)
+        writer.writerow(list(df.columns))
+        for fila in _filas(df):
+            writer.writerow(fila)
+        texto.flush()
+        texto.detach()
+    return buf.getvalue()
+
+def _exportacion_en_detalle(e: dict, clave: tuple, generar) -> bytes:
+    # El archivo se guarda en la entrada del proyecto: cuenta para DETALLE_MEMORIA_MB
+    # y se desaloja junto con ella
+    c = _cache_detalle()
+    with c["lock"]:
+        data = e["exportes"].get(clave)
+    if data is None:
+        data = generar()
+        with c["lock"]:
+            if clave not in e["exportes"]:
+                e["exportes"][clave] = data
+                _sumar_bytes(c, e, len(data))
+    return data
+
+def exportar_items(e: dict, formato: str) -> bytes:
+    tabla = e["items"][list(TABLA_COMPLETA_COLS)].rename(columns=TABLA_COMPLETA_COLS)
+    return _exportacion_en_detalle(e, ("items", formato), lambda: exportar_tabla(tabla, formato, hoja="Items"))
+
+def exportar_criticos(e: dict, dia: str, formato: str) -> bytes:
+    return _exportacion_en_detalle(
+        e, ("criticos", dia, formato), lambda: exportar_tabla(detalle_criticos(e, dia), formato, hoja="Criticos")
+    )
+
 # =========================
 # KPI CARD
 # =========================
@@ -449,6 +1076,95 @@ def tendencia_semanal(trend_records, titulo="Tendencia semanal de solicitudes"):
     )
     st.plotly_chart(fig, use_container_width=True, config={"displayModeBar": False})
 
+def _layout_barras(fig, titulo, titulo_x, tickformat):
+    fig.update_layout(
+        title=dict(text=titulo, font=dict(color="#0F172A", size=18)),
+        template="plotly_white",
+        barmode="stack",
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        font=dict(color="#0F172A"),
+        margin=dict(l=10, r=10, t=55, b=45),
+        height=360,
+        xaxis=dict(
+            title=titulo_x,
+            showgrid=False,
+            linecolor="rgba(15,23,42,.25)",
+            tickformat=tickformat,
+            tickfont=dict(color="#0F172A", size=11),
+            ticks="outside"
+        ),
+        yaxis=dict(
+            title="Cantidad",
+            showgrid=True,
+            gridcolor="rgba(15,23,42,.08)",
+            linecolor="rgba(15,23,42,.25)",
+            tickfont=dict(color="#0F172A", size=11),
+            rangemode="tozero",
+            ticks="outside"
+        ),
+        legend=dict(orientation="h", y=1.12, x=0.01, font=dict(color="#0F172A")),
+    )
+
+def grafica_entregas(df_ent: pd.DataFrame, ventana: str, titulo="Entregas por fecha prometida"):
+    titulo_x = {"Mensual": "Mes", "Móvil 4 semanas": "Semana (4 semanas acumuladas)"}.get(ventana, "Semana")
+    tickformat = "%m/%Y" if ventana == "Mensual" else "%d/%m\n%Y"
+    fmt_hover = "%{x|%m/%Y}" if ventana == "Mensual" else "%{x|%d/%m/%Y}"
+    tarde = df_ent[[c for c, _, _ in RETRASO_RANGOS]].sum(axis=1)
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=df_ent["PERIODO"], y=df_ent["a_tiempo"], name="A tiempo", marker_color="#22C55E",
+        hovertemplate=f"{fmt_hover}<br>A tiempo: %{{y}}<extra></extra>"
+    ))
+    fig.add_trace(go.Bar(
+        x=df_ent["PERIODO"], y=tarde, name="Con retraso", marker_color="#EF4444",
+        hovertemplate=f"{fmt_hover}<br>Con retraso: %{{y}}<extra></extra>"
+    ))
+    fig.add_trace(go.Scatter(
+        x=df_ent["PERIODO"], y=df_ent["abiertos"], name="Abiertos (sin llegada)", mode="lines+markers",
+        line=dict(color="#60A5FA", width=3), marker=dict(size=7, color="#60A5FA"),
+        hovertemplate=f"{fmt_hover}<br>Abiertos: %{{y}}<extra></extra>"
+    ))
+    _layout_barras(fig, titulo, titulo_x, tickformat)
+    st.plotly_chart(fig, use_container_width=True, config={"displayModeBar": False})
+
+def grafica_retrasos(df_ent: pd.DataFrame, titulo="Distribución de retrasos"):
+    etiquetas = ["A tiempo"] + [e for _, e, _ in RETRASO_RANGOS]
+    valores = [int(df_ent[c].sum()) for c in ["a_tiempo"] + [c for c, _, _ in RETRASO_RANGOS]]
+    colores = ["#22C55E", "#FACC15", "#FB923C", "#F97316", "#EF4444"]
+
+    fig = go.Figure(data=[go.Bar(
+        x=etiquetas, y=valores, marker_color=colores,
+        hovertemplate="%{x}<br>Entregas: %{y}<extra></extra>"
+    )])
+    _layout_barras(fig, titulo, "Días de retraso vs. fecha prometida", None)
+    fig.update_layout(showlegend=False)
+    st.plotly_chart(fig, use_container_width=True, config={"displayModeBar": False})
+
+# =========================
+# ESTADO
+# =========================
+# Después de todas las definiciones: cargar_datos puede convertir la BD y para eso
+# usa las funciones de items, reglas y agregados de más arriba
+if "proyectos" not in st.session_state:
+    try:
+        st.session_state.proyectos = cargar_datos()
+    except Exception as e:
+        st.error(f"No se pudo leer la base de datos de proyectos ({DB_FORMAT}): {e}")
+        st.stop()
+if "modo" not in st.session_state:
+    st.session_state.modo = None
+if "admin_ok" not in st.session_state:
+    st.session_state.admin_ok = False
+
+if "login_choice" not in st.session_state:
+    st.session_state.login_choice = None
+if "login_error" not in st.session_state:
+    st.session_state.login_error = ""
+if "carga_avisos" not in st.session_state:
+    st.session_state.carga_avisos = []
+
 # =========================
 # CSS / TEMA
 # =========================
@@ -663,10 +1379,12 @@ with st.sidebar:
 # =========================
 # ADMIN: CARGA MULTIPLE + PDF
 # =========================
-if st.session_state.modo == "admin" and st.session_state.admin_ok:
+# Cada sección es un fragmento: sus widgets solo re-ejecutan esa sección.
+@st.fragment
+def panel_carga_excel():
     st.markdown('<div class="tng-card">', unsafe_allow_html=True)
     st.subheader("Cargar proyectos (múltiples)")
-    st.caption("Selecciona varios archivos .xlsx para actualizar proyectos (se reemplaza por nombre de proyecto).")
+    st.caption("Selecciona varios archivos .xlsx para actualizar proyectos (se reemplaza por nombre de proyecto). Un libro puede traer un proyecto por hoja.")
 
     excel_files = st.file_uploader("Subir Excel (.xlsx)", type=["xlsx"], accept_multiple_files=True)
 
@@ -680,44 +1398,54 @@ if st.session_state.modo == "admin" and st.session_state.admin_ok:
         if not excel_files:
             st.warning("Selecciona al menos un archivo Excel.")
         else:
-            ok, errores = 0, 0
+            ok, errores, conflictos = 0, 0, 0
+            avisos = []
+            # Versión de cada proyecto tal como la vio esta sesión
+            versiones = {p["nombre"]: p.get("version", 0) for p in st.session_state.proyectos}
             for f in excel_files:
                 try:
-                    data = f.getvalue()
-                    nombre = leer_nombre_proyecto_excel(data)
-                    df = leer_tabla_excel(data)
-                    df = filtrar_servicios(df)  # <-- SERVICIO/SERVICIOS fuera desde carga
-                    resumen = procesar_resumen(df)
+                    hojas = procesar_libro(f.getvalue(), do_dedup)
+                except Exception as e:
+                    errores += 1
+                    avisos.append(("error", f"Error en {getattr(f,'name','archivo')}: {e}"))
+                    continue
+
+                for hoja, nombre, resumen in hojas:
+                    if isinstance(resumen, Exception):
+                        errores += 1
+                        avisos.append(("error", f"Error en {f.name} [{hoja}]: {resumen}"))
+                        continue
 
                     nuevo = {
-                        "id": f"proj_{dt.datetime.now().timestamp()}",
+                        "id": f"proj_{dt.datetime.now().timestamp()}_{uuid.uuid4().hex[:8]}",
                         "nombre": nombre,
                         "fecha_carga": dt.datetime.now().isoformat(timespec="seconds"),
-                        "archivo": f.name,
+                        "archivo": f.name if len(hojas) == 1 else f"{f.name} [{hoja}]",
                         "resumen": resumen
                     }
 
-                    if do_replace:
-                        st.session_state.proyectos = upsert_proyecto(st.session_state.proyectos, nuevo)
+                    guardado, msg = guardar_proyecto(nuevo, versiones.get(nombre), reemplazar=do_replace)
+                    if guardado:
+                        versiones[nombre] = nuevo["version"]
+                        ok += 1
                     else:
-                        st.session_state.proyectos.append(nuevo)
-                    ok += 1
-                except Exception as e:
-                    errores += 1
-                    st.error(f"Error en {getattr(f,'name','archivo')}: {e}")
+                        conflictos += 1
+                        avisos.append(("warning", msg))
 
-            if do_dedup:
-                for p in st.session_state.proyectos:
-                    items = p.get("resumen", {}).get("items", [])
-                    p["resumen"]["items"] = dedup_items_por_clave(items, keys=["no_sc", "descripcion", "no_oc"])
+            # Recarga desde disco: incluye lo que otras sesiones guardaron
+            st.session_state.proyectos = cargar_datos()
+            avisos.append(("success", f"Procesados: {ok}. Conflictos: {conflictos}. Errores: {errores}."))
+            st.session_state.carga_avisos = avisos
+            st.rerun()  # toda la app: cambió la lista de proyectos
 
-            guardar_datos(st.session_state.proyectos)
-            st.success(f"Procesados: {ok}. Errores: {errores}.")
-            st.rerun()
+    for tipo, msg in st.session_state.carga_avisos:
+        getattr(st, tipo)(msg)
+    st.session_state.carga_avisos = []
 
     st.markdown("</div>", unsafe_allow_html=True)
-    st.write("")
 
+@st.fragment
+def panel_subir_pdf():
     st.markdown('<div class="tng-card">', unsafe_allow_html=True)
     st.subheader("📄 Subir PDF")
     st.caption("Sube un PDF para que esté disponible para todos (admin + invitados).")
@@ -725,182 +1453,276 @@ if st.session_state.modo == "admin" and st.session_state.admin_ok:
     pdf_file = st.file_uploader("Subir PDF", type=["pdf"], key="pdf_uploader")
     if pdf_file:
         safe_name = pdf_file.name.replace(" ", "_")
-        path = os.path.join(PDF_DIR, safe_name)
-        with open(path, "wb") as out:
-            out.write(pdf_file.getbuffer())
+        if st.session_state.get("pdf_guardado") != pdf_file.file_id:
+            path = os.path.join(PDF_DIR, safe_name)
+            with open(path, "wb") as out:
+                out.write(pdf_file.getbuffer())
+            st.session_state.pdf_guardado = pdf_file.file_id
+            st.rerun()  # toda la app: la lista de notas cambió
         st.success(f"PDF guardado: {safe_name}")
 
     st.markdown("</div>", unsafe_allow_html=True)
+
+@st.fragment
+def panel_memoria():
+    st.markdown('<div class="tng-card">', unsafe_allow_html=True)
+    st.subheader("🧠 Memoria de detalles")
+    st.caption(f"Items, críticos y exportaciones cargados en este proceso (tope DETALLE_MEMORIA_MB = {DETALLE_MEMORIA_MB:.0f} MB).")
+
+    m = estadisticas_detalle()
+    consultas = m["aciertos"] + m["fallos"]
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("En memoria", f"{m['mb']:.1f} MB")
+    m2.metric("Proyectos cargados", f"{m['proyectos']:,}")
+    m3.metric("Aciertos / fallos", f"{m['aciertos']:,} / {m['fallos']:,}",
+              help=f"Tasa de acierto: {m['aciertos'] * 100.0 / consultas:.1f}%" if consultas else None)
+    m4.metric("Desalojos", f"{m['desalojos']:,}")
+    st.button("Actualizar", key="memoria_actualizar")  # re-ejecuta solo este panel
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
+if st.session_state.modo == "admin" and st.session_state.admin_ok:
+    panel_carga_excel()
+    st.write("")
+    panel_subir_pdf()
+    st.write("")
+    panel_memoria()
     st.write("")
 
 # =========================
 # DASHBOARD
 # =========================
-if not st.session_state.proyectos:
-    st.info("No hay proyectos cargados todavía.")
-    st.stop()
-
-nombres = sorted([p["nombre"] for p in st.session_state.proyectos])
-seleccion = st.selectbox("Selecciona un proyecto", nombres, key="select_proyecto")
-
-proyecto = next((p for p in st.session_state.proyectos if p["nombre"] == seleccion), None)
-if not proyecto:
-    st.warning("Proyecto no encontrado.")
-    st.stop()
-
-r = proyecto["resumen"]
-
-# Limpieza por si BD vieja trae SERVICIO/SERVICIOS
-r["items"] = filtrar_items_servicios(r.get("items", []))
-
-# Recalcular si faltan campos (BD vieja) usando items ya limpios
-items_bd = r.get("items", [])
-if ("conteo_general" not in r) or (not isinstance(r.get("conteo_general", None), dict)) or ("trend" not in r):
-    conteo_general_tmp, trend_tmp = construir_conteo_general_y_trend_desde_items(items_bd)
-    r["conteo_general"] = conteo_general_tmp
-    r["trend"] = trend_tmp
-if "sin_oc_real" not in r:
-    r["sin_oc_real"] = int(pd.Series([x.get("no_oc", None) for x in items_bd]).apply(is_empty_oc).sum()) if items_bd else 0
-
-st.markdown('<div class="tng-card">', unsafe_allow_html=True)
-st.subheader(f"Proyecto: {proyecto['nombre']}")
-st.markdown(
-    f"<div style='font-size:.9rem;'>Última carga: {proyecto.get('fecha_carga','-')} | Archivo: {proyecto.get('archivo','-')}</div>",
-    unsafe_allow_html=True
-)
-st.markdown("</div>", unsafe_allow_html=True)
-st.write("")
+@st.fragment
+def seccion_graficas(r: dict):
+    g1, g2 = st.columns([2, 1])
+    with g1:
+        st.markdown('<div class="tng-card">', unsafe_allow_html=True)
+        tendencia_semanal(r.get("trend", []), "Tendencia semanal de solicitudes")
+        st.markdown('</div>', unsafe_allow_html=True)
 
-# KPIs
-k1, k2, k3, k4 = st.columns(4)
-total_partidas = r.get("total_registros", 0)
-conteo_general = r.get("conteo_general", {}) or {}
-completados = int(conteo_general.get("COMPLETADO", 0))
-sin_oc_real = int(r.get("sin_oc_real", 0))
-avance_pct = (completados * 100.0 / total_partidas) if total_partidas else 0.0
-
-with k1:
-    kpi_card("Items Solicitados", f"{total_partidas:,}", "Total de partidas", tone="accent")
-with k2:
-    kpi_card("Completados", f"{completados:,}", "General (OC/SC)", tone="ok")
-with k3:
-    kpi_card("Items sin OC", f"{sin_oc_real:,}", "No. O.C. vacío/NaN", tone="warn")
-with k4:
-    kpi_card("Avance", f"{avance_pct:.1f}%", "Completados / total", tone="ok" if avance_pct >= 75 else "warn")
+    with g2:
+        st.markdown('<div class="tng-card">', unsafe_allow_html=True)
+        donut_general(r.get("conteo_general", {}) or {}, "Estado actual")
+        st.markdown('</div>', unsafe_allow_html=True)
 
-st.write("")
+# =========================
+# ENTREGAS (A TIEMPO / RETRASO / ABIERTOS)
+# =========================
+@st.fragment
+def seccion_entregas(proyecto: dict):
+    st.write("")
+    st.subheader("🚚 Entregas")
+
+    # Todo sale de los bins semanales guardados: cambiar ventana o proyectos no relee items
+    nombres = sorted([p["nombre"] for p in st.session_state.proyectos])
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        seleccion = st.multiselect(
+            "Proyectos", nombres, default=[proyecto["nombre"]], key=f"entregas_proyectos_{proyecto.get('id', proyecto['nombre'])}"
+        )
+    with c2:
+        ventana = st.radio("Ventana", ENTREGAS_VENTANAS, horizontal=True, key="entregas_ventana")
 
-# Gráficas
-g1, g2 = st.columns([2, 1])
-with g1:
-    st.markdown('<div class="tng-card">', unsafe_allow_html=True)
-    tendencia_semanal(r.get("trend", []), "Tendencia semanal de solicitudes")
-    st.markdown('</div>', unsafe_allow_html=True)
+    bins = [bins_entrega(p) for p in st.session_state.proyectos if p["nombre"] in seleccion]
+    df_ent = combinar_entregas(bins, ventana)
+    if df_ent.empty:
+        st.info("No hay fechas prometidas para analizar entregas.")
+        return
 
-with g2:
-    st.markdown('<div class="tng-card">', unsafe_allow_html=True)
-    donut_general(conteo_general, "Estado actual")
-    st.markdown('</div>', unsafe_allow_html=True)
+    # Los totales salen siempre de la semanal: la móvil suma cada semana varias veces
+    # y la mensual fecha en el día 1 semanas que aún no cierran (abiertos vencidos)
+    df_tot = combinar_entregas(bins, "Semanal")
+    a_tiempo = int(df_tot["a_tiempo"].sum())
+    tarde = int(df_tot[[c for c, _, _ in RETRASO_RANGOS]].sum().sum())
+    entregados = a_tiempo + tarde
+    hoy = pd.Timestamp.today().normalize()
+    # Abiertos al momento de la carga cuya semana prometida ya cerró
+    abiertos_vencidos = int(df_tot.loc[pd.to_datetime(df_tot["PERIODO"]) < hoy, "abiertos"].sum())
+
+    k1, k2, k3, k4 = st.columns(4)
+    with k1:
+        kpi_card("Entregados", f"{entregados:,}", "Con fecha de llegada", tone="accent")
+    with k2:
+        pct = (a_tiempo * 100.0 / entregados) if entregados else 0.0
+        kpi_card("A tiempo", f"{pct:.1f}%", f"{a_tiempo:,} de {entregados:,}", tone="ok" if pct >= 75 else "warn")
+    with k3:
+        prom = (df_tot["dias_retraso"].sum() / tarde) if tarde else 0.0
+        kpi_card("Retraso promedio", f"{prom:.1f} días", f"{tarde:,} entregas tarde", tone="warn" if tarde else "ok")
+    with k4:
+        kpi_card("Abiertos vencidos", f"{abiertos_vencidos:,}", "Semana prometida cerrada", tone="warn" if abiertos_vencidos else "ok")
+
+    g1, g2 = st.columns([2, 1])
+    with g1:
+        st.markdown('<div class="tng-card">', unsafe_allow_html=True)
+        grafica_entregas(df_ent, ventana)
+        st.markdown('</div>', unsafe_allow_html=True)
+    with g2:
+        st.markdown('<div class="tng-card">', unsafe_allow_html=True)
+        grafica_retrasos(df_tot)
+        st.markdown('</div>', unsafe_allow_html=True)
 
 # =========================
 # TABLA CRÍTICOS (SIN FILTROS) - ESTILO CLARO
 # =========================
-st.write("")
-st.subheader("📋 Gestión de Pedidos (Items Críticos)")
-
-crit = r.get("criticos", [])
-if crit:
-    dfc = pd.DataFrame(crit).copy()
-
-    if "Prometida" in dfc.columns and "Fecha prometida" not in dfc.columns:
-        dfc = dfc.rename(columns={"Prometida": "Fecha prometida"})
-
-    dfc["Fecha_prometida_dt"] = pd.to_datetime(dfc.get("Fecha prometida", None), format="%d/%m/%Y", errors="coerce")
-    dfc["Dias"] = dfc["Fecha_prometida_dt"].apply(dias_restantes)
-
-    def calc_avance(dias, est_sc, est_oc):
-        est_sc = str(est_sc).strip().upper()
-        est_oc = str(est_oc).strip().upper()
-
-        if est_sc == "COMPLETADO" and est_oc == "COMPLETADO":
-            return 100, "Completado"
-        if est_sc == "CANCELADO" or est_oc == "CANCELADO":
-            return 0, "Cancelado"
-        if dias is None:
-            return 5, "Sin fecha"
-        if dias < 0:
-            return 0, f"Vencido {abs(dias)} días"
-
-        maxwin = 30
-        pct = int(max(0, min(100, (maxwin - min(dias, maxwin)) * 100 / maxwin)))
-        return pct, f"{dias} días restantes"
-
-    dfc[["Avance %", "Detalle avance"]] = dfc.apply(
-        lambda x: pd.Series(calc_avance(x.get("Dias"), x.get("Estatus S.C."), x.get("Estatus O.C."))),
-        axis=1
-    )
+@st.fragment
+def seccion_criticos(dfc: pd.DataFrame):
+    st.write("")
+    st.subheader("📋 Gestión de Pedidos (Items Críticos)")
+
+    if not dfc.empty:
+        st.dataframe(
+            style_light_table(dfc),
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Avance %": st.column_config.ProgressColumn("Avance", min_value=0, max_value=100, format="%d%%"),
+            },
+        )
+    else:
+        st.success("✅ Sin materiales críticos con la lógica actual.")
 
-    cols_show = ["No. S.C.", "Título", "Estatus S.C.", "Estatus O.C.", "Fecha prometida", "Avance %", "Detalle avance"]
-    dfc = dfc[cols_show].copy()
+# =========================
+# TABLA COMPLETA (SIN FILTROS) - ESTILO CLARO
+# =========================
+@st.fragment
+def seccion_tabla_completa(items_bd: pd.DataFrame):
+    with st.expander("Ver tabla completa del proyecto"):
+        if items_bd.empty:
+            st.info("No hay items guardados en este proyecto.")
+        else:
+            show = items_bd[list(TABLA_COMPLETA_COLS)].rename(columns=TABLA_COMPLETA_COLS)
 
-    st.dataframe(
-        style_light_table(dfc),
-        use_container_width=True,
-        hide_index=True,
-        column_config={
-            "Avance %": st.column_config.ProgressColumn("Avance", min_value=0, max_value=100, format="%d%%"),
-        },
-    )
-else:
-    st.success("✅ Sin materiales críticos con la lógica actual.")
+            st.dataframe(style_light_table(show), use_container_width=True, hide_index=True)
 
 # =========================
-# TABLA COMPLETA (SIN FILTROS) - ESTILO CLARO
+# EXPORTAR ITEMS / CRÍTICOS
 # =========================
-with st.expander("Ver tabla completa del proyecto"):
-    items = filtrar_items_servicios(r.get("items", []))
-    if not items:
-        st.info("No hay items guardados en este proyecto.")
-    else:
-        dfi = pd.DataFrame(items).copy()
+@st.fragment
+def seccion_exportar(proyecto: dict, detalle: dict, dfc: pd.DataFrame):
+    st.write("")
+    st.subheader("📤 Exportar")
+    hoy_txt = pd.Timestamp.today().strftime("%Y-%m-%d")
+    archivo_base = re.sub(r"[^A-Za-z0-9_-]+", "_", proyecto["nombre"]).strip("_") or "proyecto"
+
+    formato = st.radio("Formato", list(EXPORT_MIME), horizontal=True, key="export_formato")
+    e1, e2 = st.columns(2)
+    with e1:
+        # El archivo se genera solo al hacer clic y queda con el detalle del proyecto
+        st.download_button(
+            label="Descargar items del proyecto",
+            data=partial(exportar_items, detalle, formato),
+            file_name=f"{archivo_base}_items.{formato}",
+            mime=EXPORT_MIME[formato],
+            on_click="ignore",
+            disabled=detalle["items"].empty,
+            use_container_width=True,
+            key="export_items",
+        )
+    with e2:
+        st.download_button(
+            label="Descargar items críticos",
+            data=partial(exportar_criticos, detalle, hoy_txt, formato),
+            file_name=f"{archivo_base}_criticos_{hoy_txt}.{formato}",
+            mime=EXPORT_MIME[formato],
+            on_click="ignore",
+            disabled=dfc.empty,
+            use_container_width=True,
+            key="export_criticos",
+        )
+
+@st.fragment
+def dashboard():
+    # Selector + KPIs: cambiar de proyecto re-ejecuta solo este bloque y sus secciones
+    nombres = sorted([p["nombre"] for p in st.session_state.proyectos])
+    seleccion = st.selectbox("Selecciona un proyecto", nombres, key="select_proyecto")
+
+    proyecto = next((p for p in st.session_state.proyectos if p["nombre"] == seleccion), None)
+    if not proyecto:
+        st.warning("Proyecto no encontrado.")
+        return
+
+    detalle = detalle_proyecto(proyecto)
+    if detalle is None:
+        # Otra sesión reemplazó el proyecto después de abrir esta: se refresca la lista
+        st.session_state.proyectos = cargar_datos()
+        proyecto = next((p for p in st.session_state.proyectos if p["nombre"] == seleccion), None)
+        detalle = detalle_proyecto(proyecto) if proyecto else None
+        if detalle is None:
+            st.warning("Este proyecto se actualizó o eliminó en otra sesión. Recarga la página.")
+            return
+        st.info("Este proyecto se actualizó en otra sesión; se muestra la versión más reciente.")
+
+    items_bd = detalle["items"]
+    r = resumen_vigente(proyecto, items_bd)
+
+    st.markdown('<div class="tng-card">', unsafe_allow_html=True)
+    st.subheader(f"Proyecto: {proyecto['nombre']}")
+    st.markdown(
+        f"<div style='font-size:.9rem;'>Última carga: {proyecto.get('fecha_carga','-')} | Archivo: {proyecto.get('archivo','-')}</div>",
+        unsafe_allow_html=True
+    )
+    st.markdown("</div>", unsafe_allow_html=True)
+    st.write("")
 
-        dfi["No. S.C."] = dfi.get("no_sc", "")
-        dfi["Título"] = dfi.get("titulo", "")
-        dfi["Descripción"] = dfi.get("descripcion", "")
-        dfi["No. O.C."] = dfi.get("no_oc", "")
-        dfi["Estatus S.C."] = dfi.get("estatus_sc", "")
-        dfi["Estatus O.C."] = dfi.get("estatus_oc", "")
-        dfi["Fecha prometida"] = pd.to_datetime(dfi.get("fecha_prometida", ""), errors="coerce")
-        dfi["Fecha llegada"] = pd.to_datetime(dfi.get("fecha_llegada", ""), errors="coerce")
+    # KPIs
+    k1, k2, k3, k4 = st.columns(4)
+    total_partidas = r.get("total_registros", 0)
+    conteo_general = r.get("conteo_general", {}) or {}
+    completados = int(conteo_general.get("COMPLETADO", 0))
+    sin_oc_real = int(r.get("sin_oc_real", 0))
+    avance_pct = (completados * 100.0 / total_partidas) if total_partidas else 0.0
+
+    with k1:
+        kpi_card("Items Solicitados", f"{total_partidas:,}", "Total de partidas", tone="accent")
+    with k2:
+        kpi_card("Completados", f"{completados:,}", "General (OC/SC)", tone="ok")
+    with k3:
+        kpi_card("Items sin OC", f"{sin_oc_real:,}", "No. O.C. vacío/NaN", tone="warn")
+    with k4:
+        kpi_card("Avance", f"{avance_pct:.1f}%", "Completados / total", tone="ok" if avance_pct >= 75 else "warn")
 
-        show = dfi[[
-            "No. S.C.", "Título", "Descripción", "No. O.C.",
-            "Estatus S.C.", "Estatus O.C.", "Fecha prometida", "Fecha llegada"
-        ]].copy()
+    st.write("")
 
-        st.dataframe(style_light_table(show), use_container_width=True, hide_index=True)
+    dfc = detalle_criticos(detalle, pd.Timestamp.today().strftime("%Y-%m-%d"))
+    seccion_graficas(r)
+    seccion_entregas(proyecto)
+    seccion_criticos(dfc)
+    seccion_tabla_completa(items_bd)
+    seccion_exportar(proyecto, detalle, dfc)
 
 # =========================
 # DESCARGA DE NOTAS (PDF) - TODOS
 # =========================
-st.write("")
-st.subheader("📥 Notas Descargables")
+def leer_pdf(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
 
-pdfs = [f for f in os.listdir(PDF_DIR) if f.lower().endswith(".pdf")]
-if pdfs:
-    st.markdown('<div class="tng-card">', unsafe_allow_html=True)
-    st.caption("Haz clic en el botón para descargar las notas del proyecto.")
-    for pdf_name in pdfs:
-        path = os.path.join(PDF_DIR, pdf_name)
-        with open(path, "rb") as f:
-            pdf_bytes = f.read()
-        st.download_button(
-            label=f"📄 Descargar {pdf_name}",
-            data=pdf_bytes,
-            file_name=pdf_name,
-            mime="application/pdf",
-            key=f"download_{pdf_name}"
-        )
-    st.markdown('</div>', unsafe_allow_html=True)
-else:
-    st.info("No hay PDFs disponibles. El administrador puede subirlos en su panel.")
+@st.fragment
+def seccion_notas():
+    st.write("")
+    st.subheader("📥 Notas Descargables")
+
+    pdfs = [f for f in os.listdir(PDF_DIR) if f.lower().endswith(".pdf")]
+    if pdfs:
+        st.markdown('<div class="tng-card">', unsafe_allow_html=True)
+        st.caption("Haz clic en el botón para descargar las notas del proyecto.")
+        for pdf_name in pdfs:
+            # Se lee al hacer clic, no en cada ejecución
+            st.download_button(
+                label=f"📄 Descargar {pdf_name}",
+                data=partial(leer_pdf, os.path.join(PDF_DIR, pdf_name)),
+                file_name=pdf_name,
+                mime="application/pdf",
+                on_click="ignore",
+                key=f"download_{pdf_name}"
+            )
+        st.markdown('</div>', unsafe_allow_html=True)
+    else:
+        st.info("No hay PDFs disponibles. El administrador puede subirlos en su panel.")
+
+if not st.session_state.proyectos:
+    st.info("No hay proyectos cargados todavía.")
+    st.stop()
+
+dashboard()
+seccion_notas()
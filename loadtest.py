@@ -0,0 +1,255 @@
+# =========================
+# PRUEBA DE CARGA (sesiones concurrentes)
+# =========================
+# Simula N sesiones de invitado contra una BD sintética usando AppTest de Streamlit
+# y reporta percentiles de latencia por interacción y la memoria (RSS) del proceso.
+#
+#   python loadtest.py --sesiones 8 --interacciones 20 --proyectos 30 --items 2000
+#   python loadtest.py --sesiones 16 --max-p95-ms 1500 --json resultado.json
+#
+# Las sesiones de un proceso comparten caches y memoria, como en una instancia real;
+# --procesos reparte las sesiones en varios procesos para medir contención de CPU.
+# AppTest re-ejecuta el script completo en cada interacción, así que las latencias
+# son una cota superior de lo que ve el navegador con fragmentos.
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import multiprocessing as mp
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+ESTATUS_SC = ["A", "Q", "U", "X", ""]
+ESTATUS_OC = ["A", "C", "X", ""]
+
+# =========================
+# BD SINTÉTICA
+# =========================
+def generar_items(rng: random.Random, n_items: int) -> list:
+    hoy = dt.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    items = []
+    for i in range(n_items):
+        prometida = hoy + dt.timedelta(days=rng.randint(-60, 60)) if rng.random() < 0.9 else None
+        llegada = prometida + dt.timedelta(days=rng.randint(-5, 15)) if prometida and rng.random() < 0.5 else None
+        items.append({
+            "no_sc": str(100000 + i // 4),
+            "titulo": f"REQUISICION {i % 40}",
+            "descripcion": f"PARTIDA {i} MATERIAL {rng.randint(1, 500)}",
+            "estatus_sc_raw": rng.choice(ESTATUS_SC),
+            "estatus_oc_raw": rng.choice(ESTATUS_OC),
+            "no_oc": rng.choice(["", "0", str(450000 + i)]),
+            "fecha_prometida": str(prometida) if prometida else "NaT",
+            "fecha_llegada": str(llegada) if llegada else "NaT",
+        })
+    return items
+
+def generar_bd(directorio: str, n_proyectos: int, n_items: int, semilla: int):
+    # Se escribe en el formato JSON original; la app lo convierte al cargar
+    rng = random.Random(semilla)
+    proyectos = []
+    for p in range(n_proyectos):
+        proyectos.append({
+            "id": f"proj_carga_{p}",
+            "nombre": f"PROYECTO {p:03d}",
+            "fecha_carga": dt.datetime.now().isoformat(timespec="seconds"),
+            "archivo": "sintetico.xlsx",
+            "resumen": {"items": generar_items(rng, n_items)},
+        })
+    with open(os.path.join(directorio, "db_proyectos.json"), "w", encoding="utf-8") as f:
+        json.dump(proyectos, f, ensure_ascii=False)
+    return [p["nombre"] for p in proyectos]
+
+# =========================
+# MEDICIÓN
+# =========================
+def rss_actual_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            paginas = int(f.read().split()[1])
+        return paginas * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return rss_pico_mb()
+
+def rss_pico_mb() -> float:
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 1024 / 1024 if sys.platform == "darwin" else pico / 1024
+
+def percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    orden = sorted(valores)
+    k = (len(orden) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(orden) - 1)
+    return orden[i] + (orden[j] - orden[i]) * (k - i)
+
+# =========================
+# SESIONES SIMULADAS
+# =========================
+def _medir(latencias: dict, nombre: str, fn):
+    t0 = time.perf_counter()
+    at = fn()
+    latencias.setdefault(nombre, []).append((time.perf_counter() - t0) * 1000)
+    return at
+
+def correr_sesiones(directorio: str, nombres: list, n_sesiones: int, interacciones: int, semilla: int, timeout: float) -> dict:
+    # AppTest no es seguro entre hilos: las sesiones se intercalan por rondas en
+    # este proceso (todas abiertas a la vez, compartiendo caches y memoria)
+    os.chdir(directorio)
+    rng = random.Random(semilla)
+    latencias, errores, rss_max = {}, 0, rss_actual_mb()
+
+    sesiones = []
+    for _ in range(n_sesiones):
+        at = _medir(latencias, "carga_inicial", lambda: AppTest.from_file(APP_PATH, default_timeout=timeout).run())
+        boton = next(b for b in at.button if b.label == "Invitado")
+        sesiones.append(_medir(latencias, "entrar_invitado", lambda: boton.click().run()))
+        rss_max = max(rss_max, rss_actual_mb())
+
+    for _ in range(interacciones):
+        for i in rng.sample(range(n_sesiones), n_sesiones):
+            at = sesiones[i]
+            if at.exception or not at.selectbox:
+                errores += 1
+                continue
+            azar = rng.random()
+            if azar < 0.6:
+                nombre = rng.choice(nombres)
+                at = _medir(latencias, "seleccionar_proyecto", lambda: at.selectbox[0].set_value(nombre).run())
+            elif azar < 0.8:
+                ventana = rng.choice(["Semanal", "Mensual", "Móvil 4 semanas"])
+                radio = next(r for r in at.radio if r.label == "Ventana")
+                at = _medir(latencias, "cambiar_ventana", lambda: radio.set_value(ventana).run())
+            else:
+                formato = rng.choice(["xlsx", "csv"])
+                radio = next(r for r in at.radio if r.label == "Formato")
+                at = _medir(latencias, "cambiar_formato", lambda: radio.set_value(formato).run())
+            sesiones[i] = at
+            rss_max = max(rss_max, rss_actual_mb())
+
+    errores += sum(1 for at in sesiones if at.exception)
+    return {"latencias": latencias, "errores": errores, "rss_max": rss_max, "rss_final": rss_actual_mb()}
+
+def _correr_proceso(args_proceso):
+    return correr_sesiones(*args_proceso)
+
+def ejecutar(args) -> dict:
+    # La BD sintética (JSON, Parquet y .bak) va en un directorio temporal que se borra
+    # al terminar; el directorio de trabajo se restaura aunque la corrida falle
+    cwd = os.getcwd()
+    directorio = tempfile.mkdtemp(prefix="tng_carga_")
+    try:
+        nombres = generar_bd(directorio, args.proyectos, args.items, args.semilla)
+        os.chdir(directorio)  # la app usa rutas relativas (BD, PDFs)
+        rss_inicio = rss_actual_mb()
+
+        # Calentamiento: conversión de la BD y caches, fuera de la medición.
+        # AppTest reemplaza __main__ con el script de la app; se restaura para que
+        # los procesos hijos puedan encontrar _correr_proceso.
+        principal = sys.modules["__main__"]
+        AppTest.from_file(APP_PATH, default_timeout=args.timeout).run()
+        sys.modules["__main__"] = principal
+
+        # Reparte las sesiones entre procesos (1 = una sola instancia, mide su RSS)
+        procesos = max(1, min(args.procesos, args.sesiones))
+        reparto = [args.sesiones // procesos + (1 if i < args.sesiones % procesos else 0) for i in range(procesos)]
+        tareas = [
+            (directorio, nombres, n, args.interacciones, args.semilla + i, args.timeout)
+            for i, n in enumerate(reparto)
+        ]
+
+        t0 = time.perf_counter()
+        if procesos == 1:
+            resultados = [correr_sesiones(*tareas[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=procesos, mp_context=mp.get_context("spawn")) as pool:
+                resultados = list(pool.map(_correr_proceso, tareas))
+        duracion = time.perf_counter() - t0
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    latencias = {}
+    for r in resultados:
+        for nombre, v in r["latencias"].items():
+            latencias.setdefault(nombre, []).extend(v)
+
+    return {
+        "config": {k: getattr(args, k) for k in ["sesiones", "procesos", "interacciones", "proyectos", "items", "semilla"]},
+        "duracion_s": round(duracion, 2),
+        "errores": sum(r["errores"] for r in resultados),
+        "latencia_ms": {
+            nombre: {
+                "n": len(v),
+                "p50": round(percentil(v, 50), 1),
+                "p95": round(percentil(v, 95), 1),
+                "p99": round(percentil(v, 99), 1),
+                "max": round(max(v), 1),
+            }
+            for nombre, v in latencias.items()
+        },
+        "rss_mb": {
+            "inicio": round(rss_inicio, 1),
+            # Con varios procesos: el mayor de ellos (lo que necesita una instancia)
+            "max_por_proceso": round(max(r["rss_max"] for r in resultados), 1),
+            "final_por_proceso": [round(r["rss_final"], 1) for r in resultados],
+        },
+    }
+
+def imprimir(res: dict):
+    c = res["config"]
+    print(f"Sesiones: {c['sesiones']} en {c['procesos']} proceso(s) | Interacciones/sesión: {c['interacciones']} | "
+          f"Proyectos: {c['proyectos']} x {c['items']} items | Duración: {res['duracion_s']} s | Errores: {res['errores']}")
+    print(f"{'interacción':<22}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for nombre, m in res["latencia_ms"].items():
+        print(f"{nombre:<22}{m['n']:>6}{m['p50']:>10}{m['p95']:>10}{m['p99']:>10}{m['max']:>10}")
+    r = res["rss_mb"]
+    print(f"RSS (MB): inicio {r['inicio']} | máx por proceso {r['max_por_proceso']} | final {r['final_por_proceso']}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones de invitado simuladas.")
+    parser.add_argument("--sesiones", type=int, default=4, help="sesiones abiertas a la vez")
+    parser.add_argument("--procesos", type=int, default=1, help="procesos en paralelo (contención de CPU)")
+    parser.add_argument("--interacciones", type=int, default=10, help="interacciones por sesión")
+    parser.add_argument("--proyectos", type=int, default=10, help="proyectos en la BD sintética")
+    parser.add_argument("--items", type=int, default=1000, help="items por proyecto")
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=120, help="timeout por ejecución de AppTest (s)")
+    parser.add_argument("--json", help="guarda el resultado en este archivo")
+    parser.add_argument("--max-p95-ms", type=float, help="falla si el p95 de alguna interacción lo supera")
+    parser.add_argument("--max-rss-mb", type=float, help="falla si el RSS máximo lo supera")
+    args = parser.parse_args(argv)
+
+    salida_json = os.path.abspath(args.json) if args.json else None
+    res = ejecutar(args)
+    imprimir(res)
+    if salida_json:
+        with open(salida_json, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+
+    fallas = []
+    if res["errores"]:
+        fallas.append(f"{res['errores']} ejecuciones con excepción")
+    if args.max_p95_ms is not None:
+        fallas += [
+            f"p95 de {n} = {m['p95']} ms > {args.max_p95_ms} ms"
+            for n, m in res["latencia_ms"].items()
+            if n != "carga_inicial" and m["p95"] > args.max_p95_ms
+        ]
+    if args.max_rss_mb is not None and res["rss_mb"]["max_por_proceso"] > args.max_rss_mb:
+        fallas.append(f"RSS {res['rss_mb']['max_por_proceso']} MB > {args.max_rss_mb} MB")
+    for f in fallas:
+        print(f"FALLA: {f}", file=sys.stderr)
+    return 1 if fallas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
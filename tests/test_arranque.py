@@ -0,0 +1,26 @@
+import os
+import random
+import sys
+
+from streamlit.testing.v1 import AppTest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(RAIZ, "app.py")
+sys.path.insert(0, RAIZ)
+
+import loadtest  # noqa: E402
+
+
+def test_arranca_con_bd_json_sin_estatus_mapeados(tmp_path, monkeypatch):
+    # Items sin estatus_sc/estatus_oc (BD original): cargar_datos los mapea y
+    # convierte la BD al iniciar la sesión, antes de dibujar nada
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DB_FORMAT", raising=False)
+    nombres = loadtest.generar_bd(str(tmp_path), 2, 50, 3)
+    assert "estatus_sc" not in loadtest.generar_items(random.Random(3), 1)[0]
+
+    at = AppTest.from_file(APP_PATH, default_timeout=60).run()
+    assert not at.exception
+    assert not at.error
+    assert sorted(p["nombre"] for p in at.session_state.proyectos) == sorted(nombres)
+    assert os.path.exists(os.path.join(tmp_path, "db_proyectos.json.bak"))
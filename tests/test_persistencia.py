@@ -0,0 +1,157 @@
+import json
+import multiprocessing as mp
+import os
+import runpy
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def _items(n):
+    return [
+        {
+            "no_sc": str(1000 + i),
+            "titulo": "REQUISICION",
+            "descripcion": f"PARTIDA {i}",
+            "estatus_sc_raw": "A",
+            "estatus_oc_raw": "A",
+            "no_oc": str(4500 + i),
+            "fecha_prometida": "2026-01-05",
+            "fecha_llegada": "2026-01-07",
+        }
+        for i in range(n)
+    ]
+
+
+def _proyecto(nombre, n_items):
+    return {
+        "id": f"proj_{uuid.uuid4().hex}",
+        "nombre": nombre,
+        "fecha_carga": "2026-01-01T00:00:00",
+        "archivo": "prueba.xlsx",
+        "resumen": {"items": _items(n_items)},
+    }
+
+
+def _app(formato):
+    # DB_FORMAT se lee al ejecutar el script: cada llamada es una "instancia" nueva
+    os.environ["DB_FORMAT"] = formato
+    return runpy.run_path(APP_PATH, run_name="app_prueba")
+
+
+def _guardar_varios(directorio, formato, nombres, version_base):
+    os.chdir(directorio)
+    app = _app(formato)
+    return [app["guardar_proyecto"](_proyecto(n, 3), version_base=version_base)[0] for n in nombres]
+
+
+@pytest.fixture
+def bd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DB_FORMAT", raising=False)
+    monkeypatch.delenv("REGLAS_FILE", raising=False)
+    yield tmp_path
+    os.environ.pop("DB_FORMAT", None)
+
+
+def _en_paralelo(tareas):
+    with ProcessPoolExecutor(max_workers=len(tareas), mp_context=mp.get_context("spawn")) as pool:
+        return list(pool.map(_guardar_varios, *zip(*tareas)))
+
+
+@pytest.mark.parametrize("formato", ["parquet", "json"])
+def test_guardados_en_paralelo_de_proyectos_distintos_no_se_pierden(bd, formato):
+    tareas = [(str(bd), formato, [f"P{w}_{i}" for i in range(5)], None) for w in range(4)]
+    resultados = _en_paralelo(tareas)
+    assert all(ok for r in resultados for ok in r)
+
+    app = _app(formato)
+    proyectos = app["cargar_datos"]()
+    assert sorted(p["nombre"] for p in proyectos) == sorted(n for t in tareas for n in t[2])
+    assert all(len(app["cargar_items_proyecto"](p)) == 3 for p in proyectos)
+
+
+@pytest.mark.parametrize("formato", ["parquet", "json"])
+def test_guardado_con_version_vieja_se_rechaza(bd, formato):
+    app = _app(formato)
+    assert app["guardar_proyecto"](_proyecto("X", 1))[0]
+    v1 = next(p for p in app["cargar_datos"]() if p["nombre"] == "X")
+    assert v1["version"] == 1
+
+    assert app["guardar_proyecto"](_proyecto("X", 2), version_base=1)[0]
+    ok, msg = app["guardar_proyecto"](_proyecto("X", 5), version_base=1)
+    assert not ok and "Conflicto" in msg
+
+    proyectos = app["cargar_datos"]()
+    assert [(p["nombre"], p["version"]) for p in proyectos] == [("X", 2)]
+    assert len(app["cargar_items_proyecto"](proyectos[0])) == 2
+    if formato == "parquet":
+        # Ni el reemplazado ni el rechazado dejan archivos de items
+        archivo = os.path.basename(app["_archivo_items"](proyectos[0]))
+        assert sorted(os.listdir("db_proyectos")) == sorted(["index.json", archivo])
+
+
+def test_guardados_en_paralelo_del_mismo_proyecto_solo_gana_uno(bd):
+    app = _app("parquet")
+    assert app["guardar_proyecto"](_proyecto("X", 1))[0]
+
+    # Todas las "sesiones" parten de la versión 1: solo la primera en guardar gana
+    resultados = _en_paralelo([(str(bd), "parquet", ["X"], 1) for _ in range(4)])
+    assert sorted(ok for r in resultados for ok in r) == [False, False, False, True]
+
+    proyectos = _app("parquet")["cargar_datos"]()
+    assert [(p["nombre"], p["version"]) for p in proyectos] == [("X", 2)]
+    assert len(os.listdir("db_proyectos")) == 2  # index.json + un archivo de items
+
+
+def _bd_json_vieja():
+    registro = _proyecto("OLD", 4)
+    registro["resumen"]["criticos"] = [{"No. S.C.": "1000"}]
+    with open("db_proyectos.json", "w", encoding="utf-8") as f:
+        json.dump([registro], f)
+
+
+def test_migracion_json_parquet_y_vuelta(bd):
+    _bd_json_vieja()
+
+    app = _app("parquet")
+    proyectos = app["cargar_datos"]()
+    assert [p["nombre"] for p in proyectos] == ["OLD"]
+    assert os.path.exists("db_proyectos.json.bak") and not os.path.exists("db_proyectos.json")
+    r = proyectos[0]["resumen"]
+    assert "criticos" not in r and "items" not in r
+    assert r["total_registros"] == 4 and r["reglas_version"] == app["reglas_version"]()
+    assert len(app["cargar_items_proyecto"](proyectos[0])) == 4
+
+    # Un proyecto subido después de migrar no puede perderse al volver a JSON
+    assert app["guardar_proyecto"](_proyecto("NEW", 2))[0]
+    app = _app("json")
+    proyectos = app["cargar_datos"]()
+    assert sorted(p["nombre"] for p in proyectos) == ["NEW", "OLD"]
+    assert os.listdir("db_proyectos") == ["index.json.bak"]
+    assert sorted(len(app["cargar_items_proyecto"](p)) for p in proyectos) == [2, 4]
+
+    # El respaldo .bak nunca se vuelve a leer
+    app = _app("parquet")
+    assert sorted(p["nombre"] for p in app["cargar_datos"]()) == ["NEW", "OLD"]
+
+
+@pytest.mark.parametrize("json_mas_nuevo", [False, True])
+def test_con_ambos_almacenes_manda_el_mas_reciente(bd, json_mas_nuevo):
+    # Árbol anterior a los respaldos .bak: quedaron el JSON y el índice parquet
+    _bd_json_vieja()
+    app = _app("parquet")
+    app["cargar_datos"]()
+    assert app["guardar_proyecto"](_proyecto("NEW", 2))[0]
+    os.replace("db_proyectos.json.bak", "db_proyectos.json")
+
+    viejo, nuevo = 1_700_000_000, 1_800_000_000
+    os.utime("db_proyectos.json", (nuevo, nuevo) if json_mas_nuevo else (viejo, viejo))
+    os.utime(os.path.join("db_proyectos", "index.json"), (viejo, viejo) if json_mas_nuevo else (nuevo, nuevo))
+
+    esperados = ["OLD"] if json_mas_nuevo else ["NEW", "OLD"]
+    for formato in ["json", "parquet"]:
+        assert sorted(p["nombre"] for p in _app(formato)["cargar_datos"]()) == esperados
@@ -0,0 +1,78 @@
+import json
+import os
+import runpy
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def _items(n):
+    return [
+        {
+            "no_sc": str(1000 + i),
+            "titulo": "REQUISICION",
+            "descripcion": f"PARTIDA {i}",
+            "estatus_sc_raw": "A",
+            "estatus_oc_raw": "A",
+            "no_oc": str(4500 + i),
+            "fecha_prometida": "2026-01-05",
+            "fecha_llegada": "2026-01-05",
+        }
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def bd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DB_FORMAT", raising=False)
+    proyectos = [
+        {"id": "proj_a", "nombre": "A", "fecha_carga": "2026-01-01T00:00:00", "resumen": {"items": _items(1)}},
+        {"id": "proj_x", "nombre": "X", "fecha_carga": "2026-01-01T00:00:00", "resumen": {"items": _items(2)}},
+    ]
+    with open("db_proyectos.json", "w", encoding="utf-8") as f:
+        json.dump(proyectos, f)
+    return tmp_path
+
+
+def _abrir_invitado():
+    at = AppTest.from_file(APP_PATH, default_timeout=60).run()
+    next(b for b in at.button if b.label == "Invitado").click().run()
+    assert not at.exception
+    return at
+
+
+def _recargar_desde_otra_sesion(nombre, n_items):
+    # Lo mismo que hace el panel de carga del admin al volver a subir un proyecto
+    app = runpy.run_path(APP_PATH, run_name="admin")
+    previo = next(p for p in app["cargar_datos"]() if p["nombre"] == nombre)
+    ok, msg = app["guardar_proyecto"](
+        {
+            "id": "proj_x_nuevo",
+            "nombre": nombre,
+            "fecha_carga": "2026-02-01T00:00:00",
+            "resumen": app["procesar_resumen"](app["pd"].DataFrame([
+                {col: it[campo] for col, campo in app["ITEM_COLS_EXCEL"].items()} for it in _items(n_items)
+            ])),
+        },
+        version_base=previo.get("version", 0),
+    )
+    assert ok, msg
+
+
+def test_sesion_con_metadatos_viejos_carga_la_version_nueva(bd):
+    at = _abrir_invitado()
+    assert at.selectbox[0].value == "A"
+
+    # X nunca se cargó en esta sesión: el reemplazo borra el archivo que conocía
+    _recargar_desde_otra_sesion("X", 3)
+
+    at.selectbox[0].set_value("X").run()
+    assert not at.exception
+    assert not at.warning
+    assert any("versión más reciente" in i.value for i in at.info)
+    assert not any("No hay items" in i.value for i in at.info)
+    assert [len(df.value) for df in at.dataframe] == [3]
+    assert next(p for p in at.session_state.proyectos if p["nombre"] == "X")["id"] == "proj_x_nuevo"